@@ -1,6 +1,9 @@
 """Main HTML to Markdown converter orchestrator."""
 
+import os
 import re
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 from tqdm import tqdm
 
@@ -13,22 +16,80 @@ from validator import OutputValidator
 from utils import ensure_directory_exists
 
 
+# Runs of three or more newlines, collapsed to a single blank line
+_MULTI_NL = re.compile(r'\n{3,}')
+
+# Markdown image references: ![alt](path)
+_IMG_PATTERN = re.compile(r'!\[([^\]]*)\]\(([^)]+)\)')
+
+# Per-worker converter instances, keyed by process id so that a forked worker
+# never reuses the parent's components
+_worker_converters = {}
+
+
+def _get_worker_converter(input_dir, output_dir):
+    """Get the converter cached for the current worker process."""
+    key = (os.getpid(), str(input_dir), str(output_dir))
+    converter = _worker_converters.get(key)
+    if converter is None:
+        converter = HtmlToMarkdownConverter(input_dir, output_dir)
+        # The parent has already created the output structure
+        converter.file_handler.prime_mkdir_cache()
+        _worker_converters[key] = converter
+    return converter
+
+
+def _process_one(args):
+    """Convert a single HTML file in a worker process.
+    
+    Returns a (html_file, md_file, image_refs, markdown_content) tuple, where
+    md_file is None if the conversion failed. Image references are handed back
+    to the parent instead of being tracked in shared state. Files without image
+    references are written here and come back without content; files with
+    them come back unwritten, since their image paths are only known once the
+    parent has processed the images.
+    """
+    html_file, input_dir, output_dir = args
+    converter = _get_worker_converter(input_dir, output_dir)
+    image_manager = converter.image_manager
+    
+    result = converter._process_html_file(html_file)
+    
+    # Hand back this file's image references and reset the worker's tracking
+    image_refs = image_manager.doc_to_images.pop(html_file, [])
+    image_manager.image_references.clear()
+    
+    if result is None:
+        return html_file, None, image_refs, None
+    
+    md_file, markdown_content = result
+    if image_refs:
+        return html_file, md_file, image_refs, markdown_content
+    
+    if not converter.file_handler.write_file(markdown_content, md_file):
+        md_file = None
+    return html_file, md_file, image_refs, None
+
+
 class HtmlToMarkdownConverter:
     """Main converter class that orchestrates the conversion process."""
     
-    def __init__(self, input_dir, output_dir):
+    def __init__(self, input_dir, output_dir, hardlink_dups=False, workers=None, verbose=False):
         self.input_dir = Path(input_dir).resolve()
         self.output_dir = Path(output_dir).resolve()
         
+        # Worker processes used to convert files, defaulting to the CPU count
+        self.workers = workers
+        
         # Extract project name from input directory
         self.project_name = self.input_dir.name.lower()
         
         # Initialize components
         self.path_resolver = PathResolver(self.input_dir, self.output_dir, self.project_name)
-        self.image_manager = ImageManager(self.project_name, self.output_dir)
+        self.image_manager = ImageManager(self.project_name, self.output_dir, hardlink_dups)
         self.preprocessor = HtmlPreprocessor(self.path_resolver, self.image_manager)
         self.markdown_converter = CustomMarkdownConverter()
-        self.file_handler = FileSystemHandler(self.output_dir)
+        self.file_handler = FileSystemHandler(self.output_dir, verbose)
         
         # Validator will be initialized after conversion
         self.validator = None
@@ -40,67 +101,120 @@ class HtmlToMarkdownConverter:
         
         # Phase 1: Setup
         ensure_directory_exists(self.output_dir)
-        self.file_handler.create_output_structure(self.input_dir)
+        scan = self.file_handler.scan_tree(self.input_dir)
+        self.file_handler.create_output_structure(scan.output_dirs)
         
         # Phase 2: Find all HTML files
-        html_files = self.file_handler.find_html_files(self.input_dir)
+        html_files = scan.html_files
         print(f"Found {len(html_files)} HTML files to convert")
         
         if not html_files:
             print("No HTML files found!")
             return False
         
-        # Phase 3: Process each HTML file
-        converted_files = []
-        for html_file in tqdm(html_files, desc="Converting files"):
-            if self._process_html_file(html_file):
-                converted_files.append(html_file)
+        # Phase 3: Process each HTML file in parallel
+        converted_count = 0
+        pending_files = []
+        workers = self.workers or os.cpu_count() or 1
+        chunksize = max(1, len(html_files) // (4 * workers))
+        tasks = [(html_file, self.input_dir, self.output_dir) for html_file in html_files]
         
-        print(f"\nConverted {len(converted_files)} files successfully")
-        
-        # Phase 4: Process images
-        print("\nProcessing images...")
-        self.image_manager.process_images(self.input_dir)
-        
-        # Get deduplication stats
-        stats = self.image_manager.get_deduplication_stats()
-        print(f"Image deduplication stats:")
-        print(f"  - Total references: {stats['total_references']}")
-        print(f"  - Unique images: {stats['unique_images']}")
-        print(f"  - Duplicates removed: {stats['duplicates_removed']}")
-        print(f"  - Deduplication ratio: {stats['deduplication_ratio']}")
-        
-        # Phase 4b: Update markdown files with actual image paths
-        print("\nUpdating image paths in markdown files...")
-        self._update_image_paths_in_markdown(converted_files)
-        
-        # Phase 5: Copy non-HTML files
-        print("\nCopying non-HTML files...")
-        self.file_handler.copy_non_html_files(self.input_dir)
+        copy_executor = ThreadPoolExecutor(max_workers=1)
+        # Shut the copy thread down on the error path too
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                result_iter = executor.map(_process_one, tasks, chunksize=chunksize)
+                
+                # Non-HTML files don't depend on the conversion, so copy them on a
+                # background thread while the workers are busy. This is only
+                # started once map() has launched the workers, so they are never
+                # forked from a process with the copy thread running.
+                copy_future = copy_executor.submit(
+                    self.file_handler.copy_non_html_files, scan.other_files
+                )
+                
+                results = list(tqdm(
+                    result_iter,
+                    total=len(tasks),
+                    desc="Converting files",
+                    mininterval=0.5,
+                    smoothing=0,
+                    disable=not sys.stderr.isatty()
+                ))
+            
+            # Merge image references in file order once the pool has drained
+            for html_file, md_file, image_refs, markdown_content in results:
+                for src in image_refs:
+                    self.image_manager.add_image_reference(src, html_file)
+                if md_file:
+                    # Files with image references are counted once written
+                    if markdown_content is None:
+                        converted_count += 1
+                    else:
+                        pending_files.append((md_file, markdown_content))
+            
+            try:
+                # Phase 4: Process images
+                print("\nProcessing images...")
+                self.image_manager.process_images(self.input_dir)
+                
+                # Get deduplication stats
+                stats = self.image_manager.get_deduplication_stats()
+                print(f"Image deduplication stats:")
+                print(f"  - Total references: {stats['total_references']}")
+                print(f"  - Unique images: {stats['unique_images']}")
+                print(f"  - Duplicates removed: {stats['duplicates_removed']}")
+                print(f"  - Deduplication ratio: {stats['deduplication_ratio']}")
+            except Exception:
+                # Don't lose the converted documents: write them with their
+                # original image paths, then report the failure
+                print("\nImage processing failed, writing markdown files with original image paths...")
+                self._write_pending_files(pending_files, update_image_paths=False)
+                raise
+            
+            # Phase 4b: Write the markdown files that reference images, with the
+            # actual image paths filled in
+            print("\nWriting markdown files with image paths...")
+            converted_count += self._write_pending_files(pending_files)
+            print(f"\nConverted {converted_count} files successfully")
+            
+            # Phase 5: Wait for the non-HTML file copies
+            print("\nCopying non-HTML files...")
+            copied = copy_future.result()
+        finally:
+            copy_executor.shutdown()
+        print(f"Copied {copied} files")
         
         # Phase 6: Cleanup
         print("\nCleaning up...")
         self.image_manager.remove_unreferenced_images()
-        self.file_handler.cleanup_empty_directories()
+        removed = self.file_handler.cleanup_empty_directories()
+        print(f"Removed {removed} empty directories")
         
         print("\nConversion complete!")
         return True
     
     def _process_html_file(self, html_file):
-        """Process a single HTML file."""
+        """Convert a single HTML file.
+        
+        Returns an (output_path, markdown_content) tuple, or None on failure.
+        Writing the markdown is left to the caller.
+        """
         # Read the HTML content
         html_content = self.file_handler.read_file(html_file)
         if html_content is None:
-            return False
+            return None
         
-        # Extract metadata
-        metadata = self.preprocessor.extract_metadata(html_content)
+        # Parse once for both metadata extraction and preprocessing; the
+        # metadata is read first, before preprocessing modifies the tree
+        soup = self.preprocessor.parse(html_content)
+        metadata = self.preprocessor.extract_metadata(soup)
         
         # Preprocess the HTML
-        preprocessed_html = self.preprocessor.preprocess(html_content, html_file)
+        content_root = self.preprocessor.preprocess_tree(soup, html_file)
         
-        # Convert to markdown
-        markdown_content = self.markdown_converter.convert(preprocessed_html)
+        # Convert to markdown straight from the preprocessed tree
+        markdown_content = self.markdown_converter.convert_tree(content_root)
         
         # Add title from metadata if available
         if metadata.get('title') and not markdown_content.startswith('#'):
@@ -112,111 +226,13 @@ class HtmlToMarkdownConverter:
         # Get output path
         output_path = self.path_resolver.get_output_path(html_file)
         
-        # Write the markdown file
-        return self.file_handler.write_file(markdown_content, output_path)
+        return output_path, markdown_content
     
     def _clean_markdown(self, content):
         """Clean up the markdown content."""
-        # Fix code blocks that appear within lists
-        content = self._fix_list_code_blocks(content)
-        
-        # Remove excessive blank lines
-        while '\n\n\n' in content:
-            content = content.replace('\n\n\n', '\n\n')
-        
-        # Ensure single blank line between sections
-        content = content.strip() + '\n'
-        
-        return content
-    
-    
-    def _fix_list_code_blocks(self, content):
-        """Fix code blocks within lists to have proper indentation and spacing."""
-        lines = content.split('\n')
-        fixed_lines = []
-        i = 0
-        in_list = False
-        
-        while i < len(lines):
-            line = lines[i]
-            
-            # Check if this is an ordered list item
-            list_match = re.match(r'^(\d+)\.\s+(.+)', line)
-            
-            if list_match:
-                in_list = True
-                # This is a list item
-                list_number = list_match.group(1)
-                list_content = list_match.group(2)
-                
-                # Check if the content ends with a code block
-                if '```' in list_content and list_content.strip().endswith('```'):
-                    # Find where the code block starts in this line
-                    code_start = list_content.find('```')
-                    if code_start > 0:
-                        # Split the line into text before code and the code block
-                        text_before = list_content[:code_start].rstrip()
-                        code_block = list_content[code_start:]
-                        
-                        # Add the list item with text
-                        fixed_lines.append(f"{list_number}. {text_before}")
-                        fixed_lines.append("")  # Empty line before code block
-                        fixed_lines.append(f"    {code_block}")  # Indented code block
-                        fixed_lines.append("")  # Empty line after code block
-                    else:
-                        fixed_lines.append(line)
-                else:
-                    fixed_lines.append(line)
-            elif in_list and line.strip() == '':
-                # Empty line in list context
-                fixed_lines.append(line)
-            elif in_list and line.strip().startswith('```'):
-                # Code block following a list item
-                # Check if previous non-empty line was a list item
-                j = len(fixed_lines) - 1
-                while j >= 0 and fixed_lines[j].strip() == '':
-                    j -= 1
-                
-                if j >= 0 and re.match(r'^\d+\.\s+', fixed_lines[j]):
-                    # This code block belongs to the list
-                    # Ensure there's exactly one empty line before
-                    while fixed_lines and fixed_lines[-1].strip() == '':
-                        fixed_lines.pop()
-                    fixed_lines.append("")
-                    
-                    # Add the indented code block
-                    code_line = line.strip()
-                    fixed_lines.append(f"    {code_line}")
-                    
-                    # If it's a multi-line code block, indent all lines until closing ```
-                    if not code_line.endswith('```') or code_line.count('```') == 1:
-                        i += 1
-                        while i < len(lines):
-                            if lines[i].strip().endswith('```') and '```' in lines[i]:
-                                fixed_lines.append(f"    {lines[i].strip()}")
-                                break
-                            else:
-                                fixed_lines.append(f"    {lines[i]}")
-                            i += 1
-                    
-                    # Add empty line after code block
-                    fixed_lines.append("")
-                else:
-                    # Not part of a list
-                    fixed_lines.append(line)
-                    in_list = False
-            elif not line.strip().startswith(('```', '-', '*', '+')) and not re.match(r'^\d+\.\s+', line) and line.strip():
-                # Regular content that's not a list item or code block
-                if in_list and not re.match(r'^\s{2,}', line):
-                    # This breaks the list context if it's not indented
-                    in_list = False
-                fixed_lines.append(line)
-            else:
-                fixed_lines.append(line)
-            
-            i += 1
-        
-        return '\n'.join(fixed_lines)
+        # Remove excessive blank lines and end with a single newline; both
+        # steps hand back the same string when there is nothing to change
+        return _MULTI_NL.sub('\n\n', content).strip() + '\n'
     
     def validate(self):
         """Validate the conversion output."""
@@ -228,46 +244,61 @@ class HtmlToMarkdownConverter:
         # Run validation
         return self.validator.validate()
     
-    def _update_image_paths_in_markdown(self, converted_files):
-        """Update image paths in markdown files after image processing."""
-        import re
+    def _write_pending_files(self, pending_files, update_image_paths=True):
+        """Write markdown files after filling in their processed image paths.
         
-        # Pattern to match markdown images
-        img_pattern = r'!\[([^\]]*)\]\(([^)]+)\)'
+        With update_image_paths=False the documents are written as converted,
+        for when image processing didn't complete. Returns the number of files
+        written successfully.
+        """
+        if update_image_paths:
+            write = self._write_pending_file
+        else:
+            write = lambda pending_file: self.file_handler.write_file(pending_file[1], pending_file[0])
         
-        for html_file in converted_files:
-            md_file = self.path_resolver.get_output_path(html_file)
-            
-            if not md_file.exists():
-                continue
+        # Files are independent and the image manager is only read from here,
+        # so the writes can overlap without locking
+        workers = min(32, (os.cpu_count() or 1) * 4)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return sum(executor.map(write, pending_files))
+    
+    def _write_pending_file(self, pending_file):
+        """Update image paths in a single markdown document and write it.
+        
+        Returns whether the write succeeded.
+        """
+        md_file, content = pending_file
+        return self.file_handler.write_file(self._update_image_paths(content), md_file)
+    
+    def _update_image_paths(self, content):
+        """Replace placeholder image paths with their processed locations."""
+        if '![' not in content:
+            return content
+        
+        external_prefixes = ('http://', 'https://')
+        get_path = self.image_manager.get_new_image_path_by_filename
+        
+        # Function to replace image paths
+        def replace_image_path(match):
+            alt_text = match.group(1)
+            img_path = match.group(2)
             
-            # Read the markdown content
-            content = self.file_handler.read_file(md_file)
-            if not content:
-                continue
+            # Skip external images
+            if img_path.startswith(external_prefixes):
+                return match.group(0)
             
-            # Function to replace image paths
-            def replace_image_path(match):
-                alt_text = match.group(1)
-                img_path = match.group(2)
-                
-                # Skip external images
-                if img_path.startswith(('http://', 'https://')):
-                    return match.group(0)
-                
-                # Extract the filename from the path
+            # Extract the filename from the path; bare filenames need no parsing
+            if '/' in img_path or '\\' in img_path:
                 filename = Path(img_path).name
-                
-                # Look up the new path from image manager
-                new_path = self.image_manager.get_new_image_path_by_filename(filename)
-                if new_path and new_path != img_path:
-                    return f'![{alt_text}]({new_path})'
-                
-                return match.group(0)
+            else:
+                filename = img_path
             
-            # Replace all image paths
-            updated_content = re.sub(img_pattern, replace_image_path, content)
+            # Look up the new path from image manager
+            new_path = get_path(filename)
+            if new_path and new_path != img_path:
+                return f'![{alt_text}]({new_path})'
             
-            # Write back if updated
-            if updated_content != content:
-                self.file_handler.write_file(updated_content, md_file)
\ No newline at end of file
+            return match.group(0)
+        
+        # Replace all image paths
+        return _IMG_PATTERN.sub(replace_image_path, content)
@@ -1,27 +1,64 @@
 """File system operations for HTML to Markdown converter."""
 
 import os
-import shutil
+from collections import namedtuple
 from pathlib import Path
-from utils import ensure_directory_exists, normalize_path
+from utils import ensure_directory_exists, fast_copy, iter_dirs, normalize_path
+
+
+# File types that are converted, and images that ImageManager handles
+_HTML_SUFFIXES = frozenset(('.html', '.htm'))
+_IMAGE_SUFFIXES = frozenset(('.png', '.jpg', '.jpeg', '.gif', '.svg', '.webp'))
+
+# Read/write buffer size, large enough to fetch most documents in one call
+_IO_BUFFER_SIZE = 1 << 20
+
+
+def _lower_suffix(name):
+    """Get the lowercased extension of a file name, including the dot."""
+    dot = name.rfind('.')
+    return name[dot:].lower() if dot >= 0 else ''
+
+
+# Work collected by a single traversal of the input tree:
+# html_files - HTML files to convert
+# other_files - (src, dst) pairs for non-HTML, non-image files to copy
+# output_dirs - output directories mirroring the input structure
+TreeScan = namedtuple('TreeScan', ['html_files', 'other_files', 'output_dirs'])
 
 
 class FileSystemHandler:
     """Handles file system operations."""
     
-    def __init__(self, output_dir):
+    def __init__(self, output_dir, verbose=False):
         self.output_dir = Path(output_dir)
+        # Print a line per copied file / removed directory instead of totals only
+        self.verbose = verbose
+        
+        # Directories known to exist, so repeated writes skip the mkdir call
+        self._mkdir_cache = set()
+    
+    def _ensure_directory(self, path):
+        """Create a directory unless it is already known to exist."""
+        if path not in self._mkdir_cache:
+            ensure_directory_exists(path)
+            self._mkdir_cache.add(path)
+    
+    def prime_mkdir_cache(self):
+        """Record every directory already present in the output tree."""
+        for dirpath, _, _, _ in iter_dirs(self.output_dir):
+            self._mkdir_cache.add(Path(dirpath))
     
-    def create_output_structure(self, input_dir):
-        """Create the output directory structure based on input."""
+    def scan_tree(self, input_dir):
+        """Walk the input directory once and collect the work for later phases."""
         input_path = Path(input_dir)
+        input_name = input_path.name.lower()
+        html_files = []
+        other_files = []
+        output_dirs = []
         
-        # Walk through input directory
-        for root, dirs, files in os.walk(input_path):
-            # Calculate relative path from input root
-            rel_path = Path(root).relative_to(input_path)
-            
-            # Normalize the path
+        for root, rel_path, _, files in iter_dirs(input_path):
+            # Normalize the path relative to the input root
             normalized_path = normalize_path(rel_path)
             
             # Check for duplicate directory names in path
@@ -30,7 +67,6 @@ class FileSystemHandler:
             
             # Look for the pattern where first part matches input dir name
             if path_parts:
-                input_name = Path(input_dir).name.lower()
                 # If we're processing a single product (e.g., product_docs/1Secure)
                 # and the first part of the path is the same product name, skip it
                 if path_parts[0].lower() == input_name:
@@ -42,21 +78,36 @@ class FileSystemHandler:
             
             normalized_path = Path(*path_parts) if path_parts else Path('.')
             
-            # Create corresponding directory in output
+            # Corresponding directory in output
             output_path = self.output_dir / normalized_path
-            ensure_directory_exists(output_path)
+            output_dirs.append(output_path)
+            
+            for file in files:
+                suffix = _lower_suffix(file)
+                if suffix in _HTML_SUFFIXES:
+                    html_files.append(Path(root) / file)
+                # Skip image files (they'll be handled by ImageManager)
+                elif suffix not in _IMAGE_SUFFIXES:
+                    other_files.append((Path(root) / file, output_path / normalize_path(file)))
+        
+        return TreeScan(html_files, other_files, output_dirs)
+    
+    def create_output_structure(self, output_dirs):
+        """Create the output directory structure collected by scan_tree."""
+        for output_path in output_dirs:
+            self._ensure_directory(output_path)
     
     def write_file(self, content, output_path):
         """Write content to a file."""
         output_path = Path(output_path)
         
         # Ensure directory exists
-        ensure_directory_exists(output_path.parent)
+        self._ensure_directory(output_path.parent)
         
         # Write the file
         try:
-            with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(content)
+            with open(output_path, 'wb', buffering=_IO_BUFFER_SIZE) as f:
+                f.write(content.encode('utf-8'))
             return True
         except (IOError, OSError) as e:
             print(f"Error writing file {output_path}: {e}")
@@ -65,83 +116,61 @@ class FileSystemHandler:
     def read_file(self, file_path):
         """Read content from a file."""
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return f.read()
+            with open(file_path, 'rb', buffering=_IO_BUFFER_SIZE) as f:
+                content = f.read().decode('utf-8', 'replace')
         except (IOError, OSError) as e:
             print(f"Error reading file {file_path}: {e}")
             return None
-    
-    def find_html_files(self, input_dir):
-        """Find all HTML files in the input directory."""
-        input_path = Path(input_dir)
-        html_files = []
-        
-        # Walk through directory
-        for root, dirs, files in os.walk(input_path):
-            for file in files:
-                if file.lower().endswith(('.html', '.htm')):
-                    html_files.append(Path(root) / file)
         
-        return html_files
+        # Keep the newline translation that text mode used to do
+        if '\r' in content:
+            content = content.replace('\r\n', '\n').replace('\r', '\n')
+        return content
     
     def cleanup_empty_directories(self):
-        """Remove empty directories from output."""
-        # Walk through output directory bottom-up
-        for root, dirs, files in os.walk(self.output_dir, topdown=False):
-            for dir_name in dirs:
-                dir_path = Path(root) / dir_name
-                try:
-                    # Try to remove directory (will fail if not empty)
-                    dir_path.rmdir()
-                    print(f"Removed empty directory: {dir_path}")
-                except OSError:
-                    # Directory not empty, skip
-                    pass
-    
-    def copy_non_html_files(self, input_dir, exclude_patterns=None):
-        """Copy non-HTML files maintaining structure."""
-        input_path = Path(input_dir)
-        exclude_patterns = exclude_patterns or ['.html', '.htm']
+        """Remove empty directories from output and return how many were removed."""
+        removed = 0
+        root = str(self.output_dir)
         
-        for root, dirs, files in os.walk(input_path):
-            rel_path = Path(root).relative_to(input_path)
-            normalized_path = normalize_path(rel_path)
-            
-            # Check for duplicate directory names in path
-            # Handle the common pattern where products have Product/Product/... structure
-            path_parts = list(normalized_path.parts)
-            
-            if path_parts:
-                input_name = Path(input_dir).name.lower()
-                # If we're processing a single product (e.g., product_docs/1Secure)
-                # and the first part of the path is the same product name, skip it
-                if path_parts[0].lower() == input_name:
-                    # This handles the 1Secure/1Secure case
-                    path_parts = path_parts[1:] if len(path_parts) > 1 else []
-                # Also check for consecutive duplicates
-                elif len(path_parts) >= 2 and path_parts[0].lower() == path_parts[1].lower():
-                    path_parts = path_parts[1:]
-            
-            normalized_path = Path(*path_parts) if path_parts else Path('.')
+        # Count the entries of every directory in one pass over the output tree
+        counts = {}
+        for dirpath, _, dirnames, filenames in iter_dirs(root):
+            counts[dirpath] = len(dirnames) + len(filenames)
+        
+        # Deepest first, so removing a child can leave its parent empty
+        for dirpath in sorted(counts, key=lambda p: p.count(os.sep), reverse=True):
+            if counts[dirpath] or dirpath == root:
+                continue
+            try:
+                os.rmdir(dirpath)
+            except OSError as e:
+                print(f"Error removing directory {dirpath}: {e}")
+                continue
             
-            output_path = self.output_dir / normalized_path
+            dir_path = Path(dirpath)
+            self._mkdir_cache.discard(dir_path)
+            removed += 1
+            if self.verbose:
+                print(f"Removed empty directory: {dir_path}")
             
-            for file in files:
-                # Skip HTML files
-                if any(file.lower().endswith(pattern) for pattern in exclude_patterns):
-                    continue
-                
-                # Skip image files (they'll be handled by ImageManager)
-                if file.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.svg', '.webp')):
-                    continue
-                
-                # Copy other files
-                src = Path(root) / file
-                dst = output_path / normalize_path(file)
-                
-                try:
-                    ensure_directory_exists(dst.parent)
-                    shutil.copy2(src, dst)
+            parent = os.path.dirname(dirpath)
+            if parent in counts:
+                counts[parent] -= 1
+        return removed
+    
+    def copy_non_html_files(self, other_files):
+        """Copy the non-HTML files collected by scan_tree, maintaining structure.
+        
+        Returns the number of files copied.
+        """
+        copied = 0
+        for src, dst in other_files:
+            try:
+                self._ensure_directory(dst.parent)
+                fast_copy(src, dst)
+                copied += 1
+                if self.verbose:
                     print(f"Copied file: {src} -> {dst}")
-                except (IOError, OSError) as e:
-                    print(f"Error copying file {src}: {e}")
\ No newline at end of file
+            except (IOError, OSError) as e:
+                print(f"Error copying file {src}: {e}")
+        return copied
\ No newline at end of file
@@ -1,31 +1,140 @@
 """Image deduplication and management for HTML to Markdown converter."""
 
+import functools
 import hashlib
-import shutil
+import itertools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from collections import defaultdict
-from utils import normalize_path, ensure_directory_exists
+from collections import Counter, defaultdict
+from utils import normalize_path, ensure_directory_exists, fast_copy, is_external_image
+
+# BLAKE3 is optional; image fingerprints fall back to SHA-256 without it
+try:
+    from blake3 import blake3
+except ImportError:
+    blake3 = None
+
+# Bytes read from the start of an image for its cheap duplicate signature
+_SIGNATURE_SIZE = 4096
+
+# Size of the read buffer used when hashing without hashlib.file_digest
+_HASH_BUFFER_SIZE = 1 << 20
+
+# Personalization of signature keys, so they never equal a content digest
+_SIGNATURE_PERSON = b'imgsig'
+
+# Hash read buffers, one per thread so concurrent hashing never shares one
+_hash_buffers = threading.local()
+
+
+def _signature_key(signature):
+    """Reduce a (size, first block) signature to a fixed-size dedup key."""
+    size, prefix = signature
+    return hashlib.blake2b(
+        size.to_bytes(8, 'little') + prefix, digest_size=32, person=_SIGNATURE_PERSON
+    ).digest()
+
+
+@functools.lru_cache(maxsize=4096)
+def _resolve_source_dir(source_doc, input_dir):
+    """Resolve the directory of a source document, once per document."""
+    source_doc_path = Path(source_doc)
+    if source_doc_path.is_absolute():
+        return str(source_doc_path.parent.resolve())
+    return str((Path(input_dir) / source_doc_path).parent.resolve())
+
+
+@functools.lru_cache(maxsize=16384)
+def _islink(path):
+    """Check whether a path is a symlink, once per path."""
+    return os.path.islink(path)
+
+
+def _join_image_path(source_dir, original_path):
+    """Join an image reference onto a resolved source directory.
+    
+    The source directory contains no symlinks, so leading '..' segments can be
+    collapsed lexically. A '..' after any other segment, or a component below
+    the source directory's ancestors that is a symlink, still goes through
+    Path.resolve.
+    """
+    rest = original_path
+    while rest.startswith('../'):
+        rest = rest[3:]
+    if rest == '..' or '..' in rest.split('/'):
+        return Path(os.path.join(source_dir, original_path)).resolve()
+    joined = os.path.normpath(os.path.join(source_dir, original_path))
+    
+    # Components shared with the source directory are already resolved
+    path = os.path.commonpath([source_dir, joined])
+    for part in os.path.relpath(joined, path).split(os.sep):
+        if part == '.':
+            continue
+        path = os.path.join(path, part)
+        if _islink(path):
+            return Path(joined).resolve()
+    return Path(joined)
+
+
+def _walk_files(root):
+    """Yield the path of every file under root as a string."""
+    stack = [root]
+    while stack:
+        dirpath = stack.pop()
+        try:
+            with os.scandir(dirpath) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file():
+                        yield entry.path
+        except OSError:
+            continue
+
+
+def _get_hash_buffer():
+    """Get this thread's reusable hash read buffer and a memoryview of it."""
+    buffers = getattr(_hash_buffers, 'buffers', None)
+    if buffers is None:
+        buf = bytearray(_HASH_BUFFER_SIZE)
+        buffers = _hash_buffers.buffers = (buf, memoryview(buf))
+    return buffers
 
 
 class ImageManager:
     """Manages image deduplication, moving, and reference tracking."""
     
-    def __init__(self, project_name, output_dir):
+    def __init__(self, project_name, output_dir, hardlink_dups=False):
         self.project_name = project_name
         self.output_dir = Path(output_dir)
+        # Link duplicates under their own name instead of only mapping them
+        self.hardlink_dups = hardlink_dups
         # Static folder should be at the same level as output_dir
         # If output_dir is /docs/markdown_docs, then static should be /docs/static
         # Use the output directory name for the static path
-        output_dirname = self.output_dir.name
-        self.static_dir = self.output_dir.parent / 'static' / 'img' / output_dirname
+        self._output_dirname = self.output_dir.name
+        self.static_dir = self.output_dir.parent / 'static' / 'img' / self._output_dirname
+        # URL prefix of every image path handed back to the markdown
+        self._static_prefix = f"/static/img/{self._output_dirname}/"
+        # Set once process_images has created the static directory
+        self._static_dir_ready = False
         
-        # Track image references: original_path -> [(doc_path, line_num), ...]
-        self.image_references = defaultdict(list)
+        # Track image references: original_path -> {doc_path: None, ...}
+        # A dict rather than a set, so each referencing document is kept once
+        # but still tried in the order it was first seen
+        self.image_references = defaultdict(dict)
         
-        # Track image hashes: original_path -> (hash, new_filename)
+        # Track image hashes: original_path -> (dedup key, new_filename)
         self.image_map = {}
         
-        # Track hash to canonical path: hash -> new_path
+        # Normalized basename -> relative path of the first image mapped with it
+        self._by_basename = {}
+        
+        # Track hash to canonical path: dedup key -> new_path. The key is the
+        # content digest, or a digest of the (size, first block) signature
+        # for files whose signature no other file shares
         self.hash_to_path = {}
         
         # Track all moved images for cleanup
@@ -35,197 +144,271 @@ class ImageManager:
         self.doc_to_images = defaultdict(list)
         
     def calculate_hash(self, file_path):
-        """Calculate SHA256 hash of a file."""
-        sha256_hash = hashlib.sha256()
+        """Calculate a content hash of a file.
+        
+        Uses BLAKE3 when the blake3 package is installed, SHA-256 otherwise.
+        Returns the raw digest bytes; hashes are only compared within a run,
+        so neither the algorithm nor a hex form is needed.
+        """
         try:
+            if blake3 is not None:
+                # Memory-maps the file and hashes it on multiple threads
+                return blake3(max_threads=blake3.AUTO).update_mmap(file_path).digest()
+            
             with open(file_path, "rb") as f:
-                for byte_block in iter(lambda: f.read(4096), b""):
-                    sha256_hash.update(byte_block)
-            return sha256_hash.hexdigest()
+                # Python 3.11+ runs the whole read/update loop in C
+                if hasattr(hashlib, 'file_digest'):
+                    return hashlib.file_digest(f, "sha256").digest()
+                
+                sha256_hash = hashlib.sha256()
+                buf, view = _get_hash_buffer()
+                while True:
+                    size = f.readinto(buf)
+                    if not size:
+                        break
+                    sha256_hash.update(view[:size])
+            return sha256_hash.digest()
         except (IOError, OSError) as e:
             print(f"Error hashing file {file_path}: {e}")
             return None
     
+    def _content_signature(self, file_path):
+        """Get a cheap (size, first block) signature of a file."""
+        try:
+            with open(file_path, "rb") as f:
+                return os.fstat(f.fileno()).st_size, f.read(_SIGNATURE_SIZE)
+        except (IOError, OSError) as e:
+            print(f"Error reading file {file_path}: {e}")
+            return None
+    
+    def _same_content(self, path_a, path_b):
+        """Check whether two files have the same content."""
+        try:
+            if os.path.getsize(path_a) != os.path.getsize(path_b):
+                return False
+        except OSError:
+            return False
+        hash_a = self.calculate_hash(path_a)
+        return hash_a is not None and hash_a == self.calculate_hash(path_b)
+    
     def add_image_reference(self, original_path, source_doc, resolved_path=None):
         """Add a reference to an image from a document."""
-        self.image_references[original_path].append(source_doc)
+        # External images are never copied, so they aren't tracked at all
+        if is_external_image(original_path):
+            return
+        self.image_references[original_path][source_doc] = None
         if resolved_path:
-            self.image_references[resolved_path].append(source_doc)
+            self.image_references[resolved_path][source_doc] = None
         # Track which images are referenced by which documents
         self.doc_to_images[source_doc].append(original_path)
     
     def process_images(self, input_dir):
         """Process all referenced images for deduplication and moving."""
         ensure_directory_exists(self.static_dir)
+        self._static_dir_ready = True
         input_dir = Path(input_dir)
         
-        # Process each unique image reference
-        processed_images = set()
+        # Resolve each unique image reference to a file on disk
+        resolved_images = []
+        inodes = []
         
         for original_path, source_docs in self.image_references.items():
-            if original_path in processed_images:
-                continue
-            processed_images.add(original_path)
-            
-            # Skip external URLs
-            if original_path.startswith(('http://', 'https://')):
-                continue
-            
             # For each source document that references this image
             full_path = None
             referencing_doc = None
             for source_doc in source_docs:
-                # Resolve relative path from the HTML file's location
-                source_doc_path = Path(source_doc)
-                if source_doc_path.is_absolute():
-                    source_dir = source_doc_path.parent
-                else:
-                    source_dir = (input_dir / source_doc).parent
-                
                 # Try to resolve the image path relative to the HTML file
                 try:
-                    resolved_path = (source_dir / original_path).resolve()
-                    if resolved_path.exists():
-                        full_path = resolved_path
-                        referencing_doc = source_doc
-                        break
+                    source_dir = _resolve_source_dir(str(source_doc), str(input_dir))
+                    resolved_path = _join_image_path(source_dir, original_path)
+                    st = resolved_path.stat()
+                    full_path = resolved_path
+                    referencing_doc = source_doc
+                    break
                 except Exception:
                     continue
             
-            if not full_path or not full_path.exists():
+            if not full_path:
                 print(f"Warning: Image not found: {original_path}")
                 continue
             
-            # Calculate hash
-            file_hash = self.calculate_hash(full_path)
+            resolved_images.append((original_path, full_path, referencing_doc))
+            inodes.append((st.st_dev, st.st_ino))
+        
+        # References that reach the same file (through different relative
+        # paths or hard links) share one inode, so each inode is read once
+        inode_paths = {}
+        for inode, (_, full_path, _) in zip(inodes, resolved_images):
+            inode_paths.setdefault(inode, full_path)
+        unique_inodes = list(inode_paths)
+        full_paths = list(inode_paths.values())
+        
+        # Only files whose size and first block match another file can be
+        # duplicates, so only those need a full hash. Any other file is keyed
+        # by its signature, which is unique among the files.
+        workers = min(32, (os.cpu_count() or 1) * 2)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            hashes = list(executor.map(self._content_signature, full_paths))
+            signature_counts = Counter(hashes)
+            collisions = [
+                i for i, signature in enumerate(hashes)
+                if signature is not None and signature_counts[signature] > 1
+            ]
+            # Reduce the unique signatures to fixed-size keys, so the first
+            # blocks are not kept for the rest of the run
+            collision_set = set(collisions)
+            for i, signature in enumerate(hashes):
+                if signature is not None and i not in collision_set:
+                    hashes[i] = _signature_key(signature)
+            del signature_counts
+            # Calculate the full hashes concurrently; hashlib releases the GIL
+            full_hashes = executor.map(self.calculate_hash, [full_paths[i] for i in collisions])
+            for i, file_hash in zip(collisions, full_hashes):
+                hashes[i] = file_hash
+        inode_to_hash = dict(zip(unique_inodes, hashes))
+        hashes = [inode_to_hash[inode] for inode in inodes]
+        
+        # Work out each referencing document's image subdirectory, and create
+        # the ones that will receive a new image in a single pass
+        image_subdirs = {}
+        needed_dirs = set()
+        seen_hashes = set(self.hash_to_path)
+        for (_, _, referencing_doc), file_hash in zip(resolved_images, hashes):
+            if not file_hash:
+                continue
+            image_subdir = image_subdirs.get(referencing_doc)
+            if image_subdir is None:
+                image_subdir = image_subdirs[referencing_doc] = self._image_subdir(referencing_doc, input_dir)
+            if file_hash not in seen_hashes:
+                seen_hashes.add(file_hash)
+                needed_dirs.add(image_subdir)
+        for image_subdir in needed_dirs:
+            ensure_directory_exists(image_subdir)
+        
+        # Deduplicate and copy sequentially, in reference order
+        for (original_path, full_path, referencing_doc), file_hash in zip(resolved_images, hashes):
             if not file_hash:
                 continue
             
-            # Determine the subdirectory structure based on the referencing document
-            if referencing_doc:
-                # Get the relative path of the document from input_dir
-                try:
-                    doc_relative = Path(referencing_doc).relative_to(input_dir)
-                except ValueError:
-                    doc_relative = Path(referencing_doc)
-                
-                # Normalize the document path and get its directory structure
-                normalized_doc_path = normalize_path(doc_relative)
-                doc_subdir = normalized_doc_path.parent
-                
-                # When project_name is "product_docs", we need special handling
-                # The structure is product_docs/Product/Product/... 
-                # We want to create static/img/product_docs/Product/... (without the duplicate)
-                subdir_parts = list(doc_subdir.parts)
-                
-                if self.project_name.lower() == "product_docs" and subdir_parts:
-                    # For product_docs, check if first two parts after product_docs are duplicates
-                    # e.g., 1secure/1secure/admin -> 1secure/admin
-                    if len(subdir_parts) >= 2 and subdir_parts[0].lower() == subdir_parts[1].lower():
-                        subdir_parts = subdir_parts[1:]
-                elif subdir_parts:
-                    # For other cases, check if first component matches project name
-                    if subdir_parts[0].lower() == self.project_name.lower():
-                        subdir_parts = subdir_parts[1:] if len(subdir_parts) > 1 else []
-                    # Check for duplicate directories (e.g., 1secure/1secure)
-                    elif len(subdir_parts) >= 2 and subdir_parts[0].lower() == subdir_parts[1].lower():
-                        subdir_parts = subdir_parts[1:]
-                
-                doc_subdir = Path(*subdir_parts) if subdir_parts else Path('.')
-                
-                # Create the subdirectory in static folder
-                if str(doc_subdir) != '.':
-                    image_subdir = self.static_dir / doc_subdir
-                else:
-                    image_subdir = self.static_dir
-            else:
-                image_subdir = self.static_dir
+            image_subdir = image_subdirs[referencing_doc]
             
             # Check if we've already processed this hash
             if file_hash in self.hash_to_path:
                 # Duplicate found, map to existing file
-                self.image_map[original_path] = (file_hash, self.hash_to_path[file_hash])
+                self._map_image(original_path, file_hash, self.hash_to_path[file_hash])
+                if self.hardlink_dups:
+                    alias = image_subdir / str(normalize_path(full_path.name))
+                    self._link_duplicate(self.static_dir / self.hash_to_path[file_hash], alias)
             else:
                 # New image, create filename without hash
                 original_name = normalize_path(full_path.name)
                 new_filename = str(original_name)
                 
-                # Ensure the subdirectory exists
-                ensure_directory_exists(image_subdir)
-                
                 # Check if a file with this name already exists (different content)
                 new_path = image_subdir / new_filename
                 if new_path.exists():
-                    # Calculate hash of existing file
-                    existing_hash = self.calculate_hash(new_path)
-                    if existing_hash != file_hash:
+                    # Compare with the content of the existing file
+                    if not self._same_content(new_path, full_path):
                         # Different file with same name - need to handle conflict
                         # Add a number suffix to make it unique
+                        # List the directory once rather than probing each
+                        # candidate name with its own stat
+                        existing = set(os.listdir(image_subdir))
                         name_parts = str(original_name).rsplit('.', 1)
                         if len(name_parts) == 2:
                             base_name, extension = name_parts
-                            counter = 1
-                            while True:
-                                new_filename = f"{base_name}_{counter}.{extension}"
-                                new_path = image_subdir / new_filename
-                                if not new_path.exists():
-                                    break
-                                counter += 1
+                            candidates = (f"{base_name}_{counter}.{extension}" for counter in itertools.count(1))
                         else:
-                            counter = 1
-                            while True:
-                                new_filename = f"{original_name}_{counter}"
-                                new_path = image_subdir / new_filename
-                                if not new_path.exists():
-                                    break
-                                counter += 1
+                            candidates = (f"{original_name}_{counter}" for counter in itertools.count(1))
+                        new_filename = next(name for name in candidates if name not in existing)
+                        new_path = image_subdir / new_filename
                         print(f"Warning: Filename conflict for {original_name}, using {new_filename}")
                     else:
                         # Same content, just use existing file
                         relative_path = new_path.relative_to(self.static_dir)
                         self.moved_images.add(str(new_path))
                         self.hash_to_path[file_hash] = str(relative_path)
-                        self.image_map[original_path] = (file_hash, str(relative_path))
+                        self._map_image(original_path, file_hash, str(relative_path))
                         continue
                 
                 # Copy the image
                 try:
-                    shutil.copy2(full_path, new_path)
+                    fast_copy(full_path, new_path, preserve_times=False)
                     relative_path = new_path.relative_to(self.static_dir)
                     self.moved_images.add(str(new_path))
                     self.hash_to_path[file_hash] = str(relative_path)
-                    self.image_map[original_path] = (file_hash, str(relative_path))
+                    self._map_image(original_path, file_hash, str(relative_path))
                     print(f"Copied image: {full_path} -> {new_path}")
                 except (IOError, OSError) as e:
                     print(f"Error copying image {full_path}: {e}")
     
+    def _image_subdir(self, referencing_doc, input_dir):
+        """Get the static subdirectory for images referenced by a document."""
+        if referencing_doc:
+            # Get the relative path of the document from input_dir
+            try:
+                doc_relative = Path(referencing_doc).relative_to(input_dir)
+            except ValueError:
+                doc_relative = Path(referencing_doc)
+            
+            # Normalize the document path and get its directory structure
+            normalized_doc_path = normalize_path(doc_relative)
+            doc_subdir = normalized_doc_path.parent
+            
+            # When project_name is "product_docs", we need special handling
+            # The structure is product_docs/Product/Product/... 
+            # We want to create static/img/product_docs/Product/... (without the duplicate)
+            subdir_parts = list(doc_subdir.parts)
+            
+            if self.project_name.lower() == "product_docs" and subdir_parts:
+                # For product_docs, check if first two parts after product_docs are duplicates
+                # e.g., 1secure/1secure/admin -> 1secure/admin
+                if len(subdir_parts) >= 2 and subdir_parts[0].lower() == subdir_parts[1].lower():
+                    subdir_parts = subdir_parts[1:]
+            elif subdir_parts:
+                # For other cases, check if first component matches project name
+                if subdir_parts[0].lower() == self.project_name.lower():
+                    subdir_parts = subdir_parts[1:] if len(subdir_parts) > 1 else []
+                # Check for duplicate directories (e.g., 1secure/1secure)
+                elif len(subdir_parts) >= 2 and subdir_parts[0].lower() == subdir_parts[1].lower():
+                    subdir_parts = subdir_parts[1:]
+            
+            doc_subdir = Path(*subdir_parts) if subdir_parts else Path('.')
+            
+            # Place images in the matching subdirectory of the static folder
+            if str(doc_subdir) != '.':
+                return self.static_dir / doc_subdir
+        return self.static_dir
+    
+    def _map_image(self, original_path, file_hash, relative_path):
+        """Record where an image reference ended up in the static directory."""
+        self.image_map[original_path] = (file_hash, relative_path)
+        basename = str(normalize_path(Path(original_path).name))
+        self._by_basename.setdefault(basename, relative_path)
+    
     def get_new_image_path(self, original_path):
         """Get the new path for an image after deduplication."""
-        if original_path in self.image_map:
-            _, new_relative_path = self.image_map[original_path]
-            output_dirname = self.output_dir.name
-            return f"/static/img/{output_dirname}/{new_relative_path}"
-        return original_path
+        entry = self.image_map.get(original_path)
+        if entry is None:
+            return original_path
+        return self._static_prefix + entry[1]
     
     def get_new_image_path_by_filename(self, filename):
         """Get the new path for an image by its filename."""
         # Normalize the filename
         normalized_filename = normalize_path(filename).name
-        output_dirname = self.output_dir.name
         
-        # Look through all processed images to find a match
-        for original_path, (file_hash, new_relative_path) in self.image_map.items():
-            # Check if the normalized filename matches
-            original_normalized = normalize_path(Path(original_path).name)
-            if str(original_normalized) == str(normalized_filename):
-                return f"/static/img/{output_dirname}/{new_relative_path}"
+        # Look up the processed images by normalized basename
+        new_relative_path = self._by_basename.get(str(normalized_filename))
+        if new_relative_path is not None:
+            return self._static_prefix + new_relative_path
         
         # If not found in the map, search recursively in static dir
-        if self.static_dir.exists():
+        if self._static_dir_ready or self.static_dir.exists():
             # Search recursively for the file
             for img_file in self.static_dir.rglob(str(normalized_filename)):
                 relative_path = img_file.relative_to(self.static_dir)
-                return f"/static/img/{output_dirname}/{relative_path}"
+                return self._static_prefix + str(relative_path)
             
             # Then try with number suffix (for conflicts)
             if isinstance(normalized_filename, Path):
@@ -235,20 +418,47 @@ class ImageManager:
             
             for img_file in self.static_dir.rglob(pattern):
                 relative_path = img_file.relative_to(self.static_dir)
-                return f"/static/img/{output_dirname}/{relative_path}"
+                return self._static_prefix + str(relative_path)
         
         return None
     
+    def _link_duplicate(self, canonical, alias):
+        """Make a duplicate image available under its own name without copying it.
+        
+        Uses a hardlink, falling back to a symlink where hardlinks aren't
+        possible. An existing link to the canonical file (e.g. from an earlier
+        run) is kept as referenced; any other existing file is left alone.
+        """
+        if alias == canonical:
+            return
+        if os.path.lexists(alias):
+            try:
+                linked = os.path.samefile(alias, canonical)
+            except OSError:
+                linked = False
+            if linked:
+                self.moved_images.add(str(alias))
+            else:
+                print(f"Warning: Not linking duplicate image {alias}, a different file exists there")
+            return
+        try:
+            ensure_directory_exists(alias.parent)
+            try:
+                os.link(canonical, alias)
+            except OSError:
+                os.symlink(os.path.relpath(canonical, alias.parent), alias)
+            self.moved_images.add(str(alias))
+            print(f"Linked duplicate image: {alias} -> {canonical}")
+        except (IOError, OSError) as e:
+            print(f"Error linking duplicate image {alias}: {e}")
+    
     def remove_unreferenced_images(self):
         """Remove images in static directory that aren't referenced."""
         if not self.static_dir.exists():
             return
         
         # Get all images in static directory (recursively)
-        all_images = set()
-        for img_file in self.static_dir.rglob('*'):
-            if img_file.is_file():
-                all_images.add(str(img_file))
+        all_images = set(_walk_files(str(self.static_dir)))
         
         # Find unreferenced images
         unreferenced = all_images - self.moved_images
@@ -31,7 +31,25 @@ from converter import HtmlToMarkdownConverter
     default=False,
     help='Overwrite output directory if it exists'
 )
-def convert(input, output, validate, force):
+@click.option(
+    '--hardlink-dups',
+    is_flag=True,
+    default=False,
+    help='Hardlink duplicate images under their own names instead of dropping them'
+)
+@click.option(
+    '--workers', '-w',
+    type=click.IntRange(min=1),
+    default=None,
+    help='Number of worker processes for converting files (default: CPU count)'
+)
+@click.option(
+    '--verbose', '-v',
+    is_flag=True,
+    default=False,
+    help='Print each copied file and removed directory, not just the totals'
+)
+def convert(input, output, validate, force, hardlink_dups, workers, verbose):
     """Convert HTML documentation to Markdown format.
     
     This tool converts HTML files to Markdown while:
@@ -47,7 +65,9 @@ def convert(input, output, validate, force):
         sys.exit(1)
     
     # Create converter
-    converter = HtmlToMarkdownConverter(input, output)
+    converter = HtmlToMarkdownConverter(
+        input, output, hardlink_dups=hardlink_dups, workers=workers, verbose=verbose
+    )
     
     # Run conversion
     try:
@@ -1,9 +1,30 @@
 """Custom markdown converter with specific rules."""
 
+import re
+
+from bs4 import NavigableString
 from markdownify import MarkdownConverter as BaseConverter
 from markdownify import UNDERSCORE
 
 
+# Ordered list item line: number and item content
+_LIST_ITEM_RE = re.compile(r'^(\d+)\.\s+(.+)')
+
+# Lines with content, for indenting blocks that belong to a list item
+_LINE_WITH_CONTENT_RE = re.compile(r'^(.+)$', re.MULTILINE)
+
+# Every line, empty or not, for indenting list item content
+_LINE_RE = re.compile(r'^(.*)', re.MULTILINE)
+
+# Anchor characters: anything that isn't alphanumeric, an underscore or a hyphen
+# is dropped, then runs of hyphens are collapsed
+_ANCHOR_INVALID_RE = re.compile(r'[^\w-]+')
+_ANCHOR_DASHES_RE = re.compile(r'-{2,}')
+
+# Text the anchor rules leave unchanged: words joined by single hyphens
+_ANCHOR_OK_RE = re.compile(r'(?:\w+-)*\w+')
+
+
 class CustomMarkdownConverter(BaseConverter):
     """Custom markdown converter with specific conversion rules."""
     
@@ -15,17 +36,41 @@ class CustomMarkdownConverter(BaseConverter):
         options.setdefault('code_language', '')
         
         super().__init__(**options)
+        
+        # Item positions of the ordered lists in the current document:
+        # id(ol) -> (ol, {id(li): index})
+        self._ol_indices = {}
+    
+    def convert_soup(self, soup):
+        """Convert a parsed document, dropping the previous document's list positions."""
+        self._ol_indices.clear()
+        try:
+            return super().convert_soup(soup)
+        finally:
+            self._ol_indices.clear()
+    
+    def convert_tree(self, root):
+        """Convert an already-parsed element as a whole document.
+        
+        Gives the same result as convert() on the element's markup, without
+        serializing and reparsing it.
+        """
+        text = self.convert_soup(root)
+        if root.name != '[document]':
+            # Apply the document-level formatting a parsed document would get
+            text = self.convert__document_(root, text, parent_tags=set())
+        return text
     
     def convert_code(self, el, text, parent_tags):
         """Convert code elements with triple backticks."""
         # Check if it's inside a <pre> tag (already a code block)
         if el.parent and el.parent.name == 'pre':
-            # This is a pre > code block, handle it as a code block
-            lang = el.get('class', '')
-            if lang and lang.startswith('language-'):
-                lang = lang.replace('language-', '')
-            else:
-                lang = ''
+            # This is a pre > code block, handle it as a code block; class is a
+            # multi-valued attribute, so look for a language-* entry among them
+            classes = el.attrs.get('class') or ()
+            if isinstance(classes, str):
+                classes = classes.split()
+            lang = next((cls[9:] for cls in classes if cls.startswith('language-')), '')
             return f"```{lang}\n{text}\n```"
         else:
             # All other code tags should be converted to code blocks with triple backticks
@@ -37,17 +82,133 @@ class CustomMarkdownConverter(BaseConverter):
         # If it contains a code element, it will be handled by convert_code
         code_el = el.find('code')
         if code_el:
-            # The code element will handle the conversion
-            return text
+            # The code element will handle the conversion; keep the block on its
+            # own lines so an enclosing list item indents it with its content
+            block = f"\n\n{text}\n\n"
         else:
             # Treat as code block
-            return f"\n```\n{text}\n```\n"
+            block = f"\n```\n{text}\n```\n"
+        
+        # A code block right after a numbered step belongs to that step, whether
+        # the step came from an <ol> or from a paragraph starting "1. "
+        if self._follows_list_item_line(el, parent_tags):
+            block = _LINE_WITH_CONTENT_RE.sub(r'    \1', block)
+        
+        return block
+    
+    def _follows_list_item_line(self, el, parent_tags):
+        """Check whether the last line of markdown before el is a numbered item.
+        
+        Only the previous siblings are rendered again, and only back to the
+        first one with any output. Blocks inside list items and blockquotes
+        are laid out by their container instead.
+        """
+        if 'li' in parent_tags or 'blockquote' in parent_tags:
+            return False
+        for sibling in el.previous_siblings:
+            if isinstance(sibling, NavigableString) and not sibling.strip():
+                continue
+            text = self.process_element(sibling, parent_tags=parent_tags).rstrip()
+            if not text:
+                continue
+            last_line = text[text.rfind('\n') + 1:]
+            return bool(_LIST_ITEM_RE.match(last_line))
+        return False
+    
+    def _split_trailing_code(self, line):
+        """Move trailing inline code in a numbered item line onto its own line.
+        
+        Returns None if the line isn't a numbered item ending in inline code.
+        """
+        list_match = _LIST_ITEM_RE.match(line)
+        if not list_match:
+            return None
+        
+        list_number = list_match.group(1)
+        list_content = list_match.group(2)
+        
+        # Split the text before the code from the code block and indent it
+        code_start = list_content.find('```')
+        if code_start > 0 and list_content.strip().endswith('```'):
+            text_before = list_content[:code_start].rstrip()
+            code_block = list_content[code_start:]
+            return f"{list_number}. {text_before}\n\n    {code_block}\n"
+        return None
+    
+    def convert_p(self, el, text, parent_tags):
+        """Convert paragraphs, treating lines that start "1. " like ordered list items."""
+        text = super().convert_p(el, text, parent_tags)
+        if '```' not in text or not parent_tags.isdisjoint(('li', 'blockquote', '_inline')):
+            return text
+        lines = text.split('\n')
+        for i, line in enumerate(lines):
+            split = self._split_trailing_code(line)
+            if split is not None:
+                lines[i] = split
+        return '\n'.join(lines)
+    
+    def _ordered_item_index(self, el):
+        """Get the position of a list item among its <ol>'s items.
+        
+        Positions are computed once per list rather than counting previous
+        siblings for every item, which is quadratic in the list length.
+        """
+        parent = el.parent
+        cached = self._ol_indices.get(id(parent))
+        if cached is None or cached[0] is not parent:
+            indices = {}
+            for li in parent.find_all('li', recursive=False):
+                indices[id(li)] = len(indices)
+            cached = self._ol_indices[id(parent)] = (parent, indices)
+        index = cached[1].get(id(el))
+        if index is None:
+            index = len(el.find_previous_siblings('li'))
+        return index
+    
+    def _convert_ordered_li(self, el, text):
+        """Convert an ordered list item; mirrors the base convert_li for <ol> parents."""
+        text = (text or '').strip()
+        if not text:
+            return "\n"
+        
+        parent = el.parent
+        start = parent.get('start')
+        if start and str(start).isnumeric():
+            start = int(start)
+        else:
+            start = 1
+        bullet = f"{start + self._ordered_item_index(el)}. "
+        bullet_width = len(bullet)
+        bullet_indent = ' ' * bullet_width
+        
+        # Indent content lines by bullet width, then put the bullet in the
+        # first line's indent
+        def _indent_for_li(match):
+            line_content = match.group(1)
+            return bullet_indent + line_content if line_content else ''
+        text = _LINE_RE.sub(_indent_for_li, text)
+        text = bullet + text[bullet_width:]
+        
+        return f"{text}\n"
+    
+    def convert_li(self, el, text, parent_tags):
+        """Convert list items, moving trailing inline code in ordered items to its own block."""
+        if el.parent is None or el.parent.name != 'ol':
+            return super().convert_li(el, text, parent_tags)
+        text = self._convert_ordered_li(el, text)
+        
+        first_line, newline, rest = text.partition('\n')
+        split = self._split_trailing_code(first_line)
+        if split is None:
+            return text
+        return split + newline + rest
     
     def convert_img(self, el, text, parent_tags):
         """Convert image elements."""
-        alt = el.get('alt', '')
-        src = el.get('src', '')
-        title = el.get('title', '')
+        attrs = el.attrs
+        alt = attrs.get('alt', '')
+        src = attrs.get('src', '')
+        title = attrs.get('title', '')
         
         # Clean up alt text
         if not alt and title:
@@ -61,8 +222,7 @@ class CustomMarkdownConverter(BaseConverter):
     
     def convert_a(self, el, text, parent_tags):
         """Convert anchor elements."""
-        href = el.get('href', '')
-        title = el.get('title', '')
+        href = el.attrs.get('href', '')
         
         # Handle empty links
         if not href:
@@ -77,7 +237,7 @@ class CustomMarkdownConverter(BaseConverter):
                 href = f'#{anchor}'
             else:
                 # Link with anchor - generate anchor from link text
-                path_part, _ = href.split('#', 1)
+                path_part = href[:href.index('#')]
                 anchor = self._generate_markdown_anchor(text)
                 href = f'{path_part}#{anchor}'
         
@@ -86,16 +246,16 @@ class CustomMarkdownConverter(BaseConverter):
     
     def _generate_markdown_anchor(self, text):
         """Generate a markdown-compatible anchor from text."""
-        # Convert to lowercase and replace spaces with hyphens
+        # Text that is already a valid anchor comes back unchanged
+        if _ANCHOR_OK_RE.fullmatch(text):
+            return text
+        
+        # Replace spaces with hyphens
         anchor = text.strip().replace(' ', '-')
         # Remove special characters except hyphens and underscores
-        anchor = ''.join(c for c in anchor if c.isalnum() or c in '-_')
-        # Remove multiple consecutive hyphens
-        while '--' in anchor:
-            anchor = anchor.replace('--', '-')
-        # Remove leading/trailing hyphens
-        anchor = anchor.strip('-')
-        return anchor
+        anchor = _ANCHOR_INVALID_RE.sub('', anchor)
+        # Collapse consecutive hyphens and trim them from the ends
+        return _ANCHOR_DASHES_RE.sub('-', anchor).strip('-')
     
     def convert_table(self, el, text, parent_tags):
         """Convert table elements with proper formatting."""
@@ -107,57 +267,50 @@ class CustomMarkdownConverter(BaseConverter):
         # First, determine the expected number of columns from the header row
         header_cells = lines[0].count('|')
         expected_cols = header_cells - 1 if header_cells > 0 else 0
+        separator = '|' + '|'.join(['---'] * expected_cols) + '|'
         
         # Process each line to ensure proper column count
         fixed_lines = []
-        for i, line in enumerate(lines):
-            if line.strip() == '':
+        for line in lines:
+            if not line.strip():
                 continue
-                
-            # Count cells in this line
-            cells = line.split('|')
-            # Remove empty cells at start and end (markdown table format)
-            if cells and cells[0].strip() == '':
-                cells = cells[1:]
-            if cells and cells[-1].strip() == '':
-                cells = cells[:-1]
             
-            current_cols = len(cells)
+            # Strip the cells once; remove empty cells at start and end
+            # (markdown table format)
+            cells = [cell.strip() for cell in line.split('|')]
+            if cells[0] == '':
+                del cells[0]
+            if cells and cells[-1] == '':
+                del cells[-1]
             
             # Check if this is a separator line
-            is_separator = all(cell.strip() == '---' or cell.strip() == '' for cell in cells)
-            
-            if is_separator:
+            if not any(cell != '---' and cell != '' for cell in cells):
                 # Ensure separator has correct number of columns
-                if current_cols != expected_cols:
-                    separator = '|' + '|'.join(['---'] * expected_cols) + '|'
-                    fixed_lines.append(separator)
-                else:
-                    fixed_lines.append(line)
+                fixed_lines.append(line if len(cells) == expected_cols else separator)
             else:
-                # Regular row - ensure it has the correct number of columns
-                if current_cols < expected_cols:
-                    # Pad with empty cells
-                    cells.extend([''] * (expected_cols - current_cols))
+                # Regular row - pad with empty cells to the expected column count
+                if len(cells) < expected_cols:
+                    cells.extend([''] * (expected_cols - len(cells)))
                 
                 # Reconstruct the line
-                fixed_line = '|' + '|'.join(f' {cell.strip()} ' for cell in cells) + '|'
-                fixed_lines.append(fixed_line)
+                fixed_lines.append('| ' + ' | '.join(cells) + ' |')
         
         # Ensure there's a separator after the header
         if len(fixed_lines) > 1:
             # Check if second line is a separator
-            second_line = fixed_lines[1] if len(fixed_lines) > 1 else ''
+            second_line = fixed_lines[1]
             cells = second_line.split('|')[1:-1] if '|' in second_line else []
-            is_separator = all(cell.strip() == '---' for cell in cells)
-            
-            if not is_separator:
+            if not all(cell.strip() == '---' for cell in cells):
                 # Insert separator after header
-                separator = '|' + '|'.join(['---'] * expected_cols) + '|'
                 fixed_lines.insert(1, separator)
         
-        return '\n' + '\n'.join(fixed_lines) + '\n'
-    
+        if not fixed_lines:
+            return '\n\n'
+        
+        # Surrounding newlines go in the same join rather than two more copies
+        fixed_lines.insert(0, '')
+        fixed_lines.append('')
+        return '\n'.join(fixed_lines)
     
     def convert_br(self, el, text, parent_tags):
         """Convert br elements."""
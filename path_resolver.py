@@ -1,11 +1,17 @@
 """Path resolution and normalization for HTML to Markdown converter."""
 
 import os
+import re
 from pathlib import Path
 from urllib.parse import unquote
 from utils import is_external_url, is_special_link, normalize_path, extract_anchor
 
 
+# Document links that are already normalized (lowercase, no spaces, no '..',
+# nothing URL-encoded), with an optional plain anchor
+_NORMALIZED_LINK_RE = re.compile(r'^(/?[a-z0-9_\-/]+\.(?:md|html?))(#[A-Za-z0-9_\-.:]*)?$')
+
+
 class PathResolver:
     """Handles path resolution and normalization."""
     
@@ -13,13 +19,31 @@ class PathResolver:
         self.input_dir = Path(input_dir).resolve()
         self.output_dir = Path(output_dir).resolve()
         self.project_name = project_name
+        # Names used by every path conversion
+        self._input_name_lower = self.input_dir.name.lower()
+        self._output_name = self.output_dir.name
         # Use output directory name for static path
-        output_dirname = self.output_dir.name
-        self.static_dir = self.output_dir.parent / 'static' / 'img' / output_dirname
+        self.static_dir = self.output_dir.parent / 'static' / 'img' / self._output_name
+        
+        # Prefixes of generated document and image paths
+        self._doc_prefix = f"/{self._output_name}/"
+        self._static_prefix = f"./static/img/{self._output_name}/"
+        # Root-relative image URL prefix, used for image placeholders
+        self.static_url_prefix = f"/static/img/{self._output_name}/"
         
         # Cache for resolved paths
         self.path_cache = {}
         
+        # Normalized directory of each source document, relative to the input
+        self._doc_dirs = {}
+        
+        # Converted document paths and output paths, keyed by their input
+        self._doc_path_cache = {}
+        self._output_path_cache = {}
+        
+        # Whether each path under the input directory is a symlink
+        self._islink_cache = {}
+        
     def resolve_path(self, current_file, target_path, path_type='document'):
         """Resolve a path from current file to target, converting to new structure."""
         # Create cache key
@@ -27,6 +51,16 @@ class PathResolver:
         if cache_key in self.path_cache:
             return self.path_cache[cache_key]
         
+        # Already-normalized document links only need joining onto the
+        # current document's directory
+        if path_type == 'document':
+            match = _NORMALIZED_LINK_RE.match(target_path)
+            if match:
+                result = self._resolve_normalized_link(current_file, match.group(1), match.group(2) or '')
+                if result is not None:
+                    self.path_cache[cache_key] = result
+                    return result
+        
         # Handle external URLs and special links
         if is_external_url(target_path) or is_special_link(target_path):
             self.path_cache[cache_key] = target_path
@@ -68,85 +102,129 @@ class PathResolver:
         self.path_cache[cache_key] = result
         return result
     
+    def _resolve_normalized_link(self, current_file, path_part, anchor):
+        """Resolve a document link that normalize_path would leave unchanged.
+        
+        Returns None if the current file is outside the input directory, or
+        the link passes through a symlink, so the caller falls back to the
+        full resolution.
+        """
+        if path_part.startswith('/'):
+            relative = Path(path_part.lstrip('/'))
+        else:
+            current_file = str(current_file)
+            if self._through_symlink(os.path.dirname(current_file), path_part):
+                return None
+            doc_dir = self._doc_dirs.get(current_file)
+            if doc_dir is None:
+                try:
+                    doc_dir = normalize_path(Path(current_file).parent.relative_to(self.input_dir))
+                except ValueError:
+                    return None
+                self._doc_dirs[current_file] = doc_dir
+            relative = doc_dir / path_part
+        return self._convert_to_document_path(relative) + anchor
+    
+    def _through_symlink(self, current_dir, path_part):
+        """Check whether a relative link reaches a symlink from current_dir.
+        
+        The full resolution follows symlinks with Path.resolve(), while the
+        fast path only joins names, so links through one must not use it.
+        """
+        islink_cache = self._islink_cache
+        path = current_dir
+        for part in path_part.split('/'):
+            if not part:
+                continue
+            path = os.path.join(path, part)
+            islink = islink_cache.get(path)
+            if islink is None:
+                islink = islink_cache[path] = os.path.islink(path)
+            if islink:
+                return True
+        return False
+    
     def _convert_to_static_path(self, normalized_path):
         """Convert a normalized path to static image path."""
         # Remove any directory structure and just use the filename
         filename = normalized_path.name
-        output_dirname = self.output_dir.name
-        return f"./static/img/{output_dirname}/{filename}"
+        return self._static_prefix + filename
     
     def _get_placeholder_image_path(self, original_path):
         """Get a placeholder path for an image that will be resolved later."""
         # Extract just the filename from the path
         filename = Path(original_path).name
         normalized_filename = normalize_path(filename)
-        output_dirname = self.output_dir.name
-        return f"./static/img/{output_dirname}/{normalized_filename}"
+        return self._static_prefix + str(normalized_filename)
+    
+    def _strip_duplicate_prefix(self, path_str):
+        """Remove a duplicated leading directory from a normalized path string.
+        
+        Handles the common pattern where products have a Product/Product/...
+        structure. Works on the string directly; the result is '' for an
+        empty path.
+        """
+        if not path_str or path_str == '.':
+            return ''
+        # An absolute path's first part is the root, which never matches
+        if path_str.startswith(os.sep):
+            return path_str
+        path_parts = path_str.split(os.sep)
+        first = path_parts[0].lower()
+        # If we're processing a single product (e.g., product_docs/1Secure)
+        # and the first part of the path is the same product name, skip it.
+        # This handles the 1Secure/1Secure case
+        if first == self._input_name_lower:
+            path_parts = path_parts[1:]
+        # Also check for consecutive duplicates
+        elif len(path_parts) >= 2 and first == path_parts[1].lower():
+            path_parts = path_parts[1:]
+        return os.sep.join(path_parts)
     
     def _convert_to_document_path(self, normalized_path):
         """Convert a normalized path to document path."""
+        key = str(normalized_path)
+        cached = self._doc_path_cache.get(key)
+        if cached is not None:
+            return cached
+        
         # Change extension from .htm/.html to .md
-        path_str = str(normalized_path)
+        path_str = key
         if path_str.endswith('.htm'):
             path_str = path_str[:-4] + '.md'
         elif path_str.endswith('.html'):
             path_str = path_str[:-5] + '.md'
         
         # Apply the same duplicate removal logic as in get_output_path
-        path_parts = list(Path(path_str).parts)
-        
-        if path_parts:
-            input_name = self.input_dir.name.lower()
-            # If we're processing a single product (e.g., product_docs/1Secure)
-            # and the first part of the path is the same product name, skip it
-            if path_parts[0].lower() == input_name:
-                # This handles the 1Secure/1Secure case
-                path_parts = path_parts[1:] if len(path_parts) > 1 else []
-            # Also check for consecutive duplicates
-            elif len(path_parts) >= 2 and path_parts[0].lower() == path_parts[1].lower():
-                path_parts = path_parts[1:]
-        
-        path_str = str(Path(*path_parts)) if path_parts else ''
+        path_str = self._strip_duplicate_prefix(path_str)
         
         # Return as absolute path from output root
-        output_dir_name = self.output_dir.name
-        return f"/{output_dir_name}/{path_str}"
+        result = self._doc_path_cache[key] = self._doc_prefix + path_str
+        return result
     
     def get_output_path(self, input_file):
         """Get the output path for a given input file."""
+        key = str(input_file)
+        cached = self._output_path_cache.get(key)
+        if cached is not None:
+            return cached
+        
         try:
             relative_path = Path(input_file).relative_to(self.input_dir)
         except ValueError:
             raise ValueError(f"Input file {input_file} is not within input directory {self.input_dir}")
         
-        # Normalize the path
-        normalized = normalize_path(relative_path)
-        
-        # Check for duplicate directory names in path
-        # Handle the common pattern where products have Product/Product/... structure
-        path_parts = list(normalized.parts)
-        
-        if path_parts:
-            input_name = self.input_dir.name.lower()
-            # If we're processing a single product (e.g., product_docs/1Secure)
-            # and the first part of the path is the same product name, skip it
-            if path_parts[0].lower() == input_name:
-                # This handles the 1Secure/1Secure case
-                path_parts = path_parts[1:] if len(path_parts) > 1 else []
-            # Also check for consecutive duplicates
-            elif len(path_parts) >= 2 and path_parts[0].lower() == path_parts[1].lower():
-                path_parts = path_parts[1:]
-        
-        normalized = Path(*path_parts) if path_parts else Path('.')
+        # Normalize the path, then drop duplicate directory names
+        path_str = self._strip_duplicate_prefix(str(normalize_path(relative_path)))
         
         # Change extension
-        path_str = str(normalized)
         if path_str.endswith('.htm'):
             path_str = path_str[:-4] + '.md'
         elif path_str.endswith('.html'):
             path_str = path_str[:-5] + '.md'
         
-        return self.output_dir / path_str
+        result = self._output_path_cache[key] = self.output_dir / path_str
+        return result
     
     def get_static_image_path(self, image_filename):
         """Get the full static path for an image file."""
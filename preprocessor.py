@@ -1,7 +1,23 @@
 """HTML preprocessing for better markdown conversion."""
 
+import soupsieve
 from bs4 import BeautifulSoup, NavigableString
 from pathlib import Path
+from utils import EXTERNAL_IMAGE_PREFIXES, is_external_url, is_special_link, normalize_path_part
+
+
+# Navigation elements removed from pages without a main content div,
+# matched in a single pass over the tree
+_NAVIGATION_SELECTOR = soupsieve.compile(
+    'nav, header, footer, .navigation, .nav, .header, .footer, '
+    '#navigation, #nav, #header, #footer'
+)
+
+# Images with a local source to track: a non-empty src that isn't external
+_LOCAL_IMAGE_SELECTOR = soupsieve.compile(
+    'img[src]:not([src=""])'
+    + ''.join(f':not([src^="{prefix}"])' for prefix in EXTERNAL_IMAGE_PREFIXES)
+)
 
 
 class HtmlPreprocessor:
@@ -11,52 +27,72 @@ class HtmlPreprocessor:
         self.path_resolver = path_resolver
         self.image_manager = image_manager
     
+    def parse(self, html_content):
+        """Parse HTML content once, for sharing between extract_metadata and preprocess."""
+        return BeautifulSoup(html_content, 'lxml')
+    
+    def _as_soup(self, html):
+        """Accept either raw HTML content or an already-parsed soup."""
+        if isinstance(html, BeautifulSoup):
+            return html
+        return self.parse(html)
+    
     def preprocess(self, html_content, source_file):
-        """Preprocess HTML content before markdown conversion."""
-        soup = BeautifulSoup(html_content, 'lxml')
+        """Preprocess HTML content before markdown conversion.
+        
+        html_content may be a soup from parse(); it is modified in place.
+        """
+        root = self.preprocess_tree(html_content, source_file)
+        if root.name == 'div':
+            return f"<html><body>{root}</body></html>"
+        return str(root)
+    
+    def preprocess_tree(self, html_content, source_file):
+        """Preprocess HTML content and return the element to convert.
+        
+        This is the main content div if there is one, otherwise the whole
+        soup. The tree can be handed straight to the markdown converter, which
+        saves serializing it and parsing it again.
+        """
+        soup = self._as_soup(html_content)
         
         # Extract only the main content
         main_content = soup.find('div', {'role': 'main'})
         if main_content:
-            # Create a new soup with just the main content
-            new_soup = BeautifulSoup('<html><body></body></html>', 'lxml')
-            new_soup.body.append(main_content)
-            soup = new_soup
+            # Work on the main content where it is instead of moving it into
+            # a freshly parsed document
+            root = main_content
         else:
             # If no main content div found, try to find the body content
             # and remove common navigation elements
-            for nav_element in soup.find_all(['nav', 'header', 'footer']):
-                nav_element.decompose()
-            
-            # Remove elements with specific classes or ids that are typically navigation
-            for selector in ['.navigation', '.nav', '.header', '.footer', '#navigation', '#nav', '#header', '#footer']:
-                for element in soup.select(selector):
+            # (including elements with classes or ids that are typically navigation)
+            for element in _NAVIGATION_SELECTOR.select(soup):
+                # Nested matches are gone once their ancestor is removed
+                if not element.decomposed:
                     element.decompose()
+            root = soup
         
         # Process all images
-        self._process_images(soup, source_file)
+        self._process_images(root, source_file)
         
         # Process all links
-        self._process_links(soup, source_file)
+        self._process_links(root, source_file)
         
         # Process code blocks
-        self._process_code_blocks(soup)
+        self._process_code_blocks(root, soup)
         
         # Clean up empty elements
-        self._clean_empty_elements(soup)
+        self._clean_empty_elements(root)
         
-        return str(soup)
+        # Merge text nodes left adjacent by the edits, as a reparse would
+        root.smooth()
+        return root
     
     def _process_images(self, soup, source_file):
         """Process all image tags to update paths."""
-        for img in soup.find_all('img'):
-            src = img.get('src', '')
-            if not src:
-                continue
-            
-            # Skip external images
-            if src.startswith(('http://', 'https://')):
-                continue
+        placeholder_prefix = self.path_resolver.static_url_prefix
+        for img in _LOCAL_IMAGE_SELECTOR.select(soup):
+            src = img['src']
             
             # Add to image manager for tracking with the source file
             self.image_manager.add_image_reference(src, source_file)
@@ -64,9 +100,7 @@ class HtmlPreprocessor:
             # For now, set a placeholder path that will be updated after image processing
             # The actual filename will be determined after deduplication
             filename = Path(src).name
-            normalized_filename = filename.lower().replace(' ', '_')
-            output_dirname = self.path_resolver.output_dir.name
-            placeholder_path = f"/static/img/{output_dirname}/{normalized_filename}"
+            placeholder_path = placeholder_prefix + normalize_path_part(filename)
             
             # Store the original src as a data attribute for later processing
             img['data-original-src'] = src
@@ -79,8 +113,9 @@ class HtmlPreprocessor:
             if not href:
                 continue
             
-            # Skip external URLs and special links
-            if href.startswith(('http://', 'https://', 'mailto:', '#', 'javascript:')):
+            # Skip every link that resolve_path would hand back unchanged:
+            # external URLs in any letter case, anchors and special links
+            if is_external_url(href) or is_special_link(href):
                 continue
             
             # Resolve the path
@@ -91,10 +126,10 @@ class HtmlPreprocessor:
             # Update the href attribute
             link['href'] = resolved_path
     
-    def _process_code_blocks(self, soup):
-        """Process code blocks for better markdown conversion."""
+    def _process_code_blocks(self, root, soup):
+        """Process code blocks under root for better markdown conversion."""
         # Find all <code> tags
-        for code in soup.find_all('code'):
+        for code in root.find_all('code'):
             # Check if it's inside a <pre> tag (already a code block)
             if code.parent and code.parent.name == 'pre':
                 continue
@@ -104,7 +139,7 @@ class HtmlPreprocessor:
             code['data-inline'] = 'true'
             
         # Process <pre> tags that might contain code
-        for pre in soup.find_all('pre'):
+        for pre in root.find_all('pre'):
             # If pre contains a code tag, it's already properly structured
             if pre.find('code'):
                 continue
@@ -117,13 +152,23 @@ class HtmlPreprocessor:
     
     def _clean_empty_elements(self, soup):
         """Remove empty elements that could cause issues."""
+        # Collect paragraphs and line breaks in a single walk of the tree
+        paragraphs = []
+        line_breaks = []
+        for element in soup.find_all(['p', 'br']):
+            (paragraphs if element.name == 'p' else line_breaks).append(element)
+        
         # Remove empty paragraphs
-        for p in soup.find_all('p'):
-            if not p.get_text(strip=True) and not p.find_all(['img', 'a']):
+        for p in paragraphs:
+            if not p.get_text(strip=True) and p.find(['img', 'a']) is None:
                 p.decompose()
         
         # Remove multiple consecutive br tags
-        for br in soup.find_all('br'):
+        for br in line_breaks:
+            # Already removed along with an empty paragraph
+            if br.decomposed:
+                continue
+            
             next_sibling = br.next_sibling
             if next_sibling and isinstance(next_sibling, NavigableString):
                 if not next_sibling.strip():
@@ -133,20 +178,28 @@ class HtmlPreprocessor:
                 br.decompose()
     
     def extract_metadata(self, html_content):
-        """Extract metadata from HTML if available."""
-        soup = BeautifulSoup(html_content, 'lxml')
+        """Extract metadata from HTML (raw content or a soup from parse()) if available."""
+        soup = self._as_soup(html_content)
         metadata = {}
         
+        # Find the title and meta tags in a single walk of the tree
+        title_tag = None
+        meta_tags = []
+        for element in soup.find_all(['title', 'meta']):
+            if element.name == 'meta':
+                meta_tags.append(element)
+            elif title_tag is None:
+                title_tag = element
+        
         # Extract title
-        title_tag = soup.find('title')
-        if title_tag:
+        if title_tag is not None:
             metadata['title'] = title_tag.get_text(strip=True)
         
         # Extract meta tags
-        for meta in soup.find_all('meta'):
+        for meta in meta_tags:
             name = meta.get('name', '')
             content = meta.get('content', '')
             if name and content:
                 metadata[name] = content
         
-        return metadata
\ No newline at end of file
+        return metadata
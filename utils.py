@@ -1,17 +1,43 @@
 """Utility functions for HTML to Markdown converter."""
 
+import errno
+import functools
 import os
 import re
+import shutil
 from pathlib import Path
 from urllib.parse import urlparse
 
 
+# Schemes of external URLs, and a precompiled check for them at the start of a
+# URL so the common case doesn't need urlparse
+_EXTERNAL_SCHEMES = ('http', 'https', 'mailto', 'ftp', 'tel')
+_EXTERNAL_SCHEME_RE = re.compile(r'(?:https?|mailto|ftp|tel):', re.IGNORECASE | re.ASCII)
+
+# Characters that urlparse strips from anywhere in a URL
+_URL_UNSAFE_RE = re.compile(r'[\t\r\n]')
+
+
 def is_external_url(url):
     """Check if a URL is external (http/https/mailto/etc)."""
     if not url:
         return False
-    parsed = urlparse(url)
-    return parsed.scheme in ('http', 'https', 'mailto', 'ftp', 'tel')
+    if _EXTERNAL_SCHEME_RE.match(url):
+        return True
+    # Only URLs that urlparse would clean up first (leading whitespace or
+    # control characters, embedded tabs and newlines) need the full parse
+    if url[0] > ' ' and not _URL_UNSAFE_RE.search(url):
+        return False
+    return urlparse(url).scheme in _EXTERNAL_SCHEMES
+
+
+# Image sources that need no local file: remote, protocol-relative or inline
+EXTERNAL_IMAGE_PREFIXES = ('http://', 'https://', 'data:', '//')
+
+
+def is_external_image(src):
+    """Check if an image source needs no local file (remote, protocol-relative or inline)."""
+    return src.startswith(EXTERNAL_IMAGE_PREFIXES)
 
 
 def is_special_link(url):
@@ -21,8 +47,46 @@ def is_special_link(url):
     return url.startswith(('#', 'javascript:', 'data:'))
 
 
+# Lowercases ASCII letters and replaces spaces with underscores
+_ASCII_NORM_TABLE = str.maketrans(
+    'ABCDEFGHIJKLMNOPQRSTUVWXYZ ',
+    'abcdefghijklmnopqrstuvwxyz_'
+)
+
+# Any non-ASCII character; str.isascii() needs Python 3.7
+_NON_ASCII_RE = re.compile(r'[^\x00-\x7f]')
+
+
+def _lower_underscore(name):
+    """Lowercase a name and replace its spaces with underscores."""
+    # ASCII names, the usual case, take a single translate pass
+    if not _NON_ASCII_RE.search(name):
+        return name.translate(_ASCII_NORM_TABLE)
+    return name.lower().replace(' ', '_')
+
+
+@functools.lru_cache(maxsize=8192)
+def normalize_path_part(part):
+    """Normalize a single path component: lowercase and replace spaces with underscores."""
+    # Split filename and extension
+    if '.' in part and not part.startswith('.'):
+        name, ext = part.rsplit('.', 1)
+        return _lower_underscore(name) + '.' + ext.lower()
+    return _lower_underscore(part)
+
+
 def normalize_path(path):
-    """Normalize a path: lowercase and replace spaces with underscores."""
+    """Normalize a path: lowercase and replace spaces with underscores.
+    
+    Results are cached by the path's string form; the same paths, directory
+    names and filenames recur across documents.
+    """
+    return _normalize_path_str(str(path))
+
+
+@functools.lru_cache(maxsize=4096)
+def _normalize_path_str(path):
+    """Normalize a path given as a string; see normalize_path."""
     # Convert to Path object for easier manipulation
     path_obj = Path(path)
     
@@ -32,13 +96,7 @@ def normalize_path(path):
         if part == '/' or part == '\\':
             parts.append(part)
         else:
-            # Split filename and extension
-            if '.' in part and not part.startswith('.'):
-                name, ext = part.rsplit('.', 1)
-                normalized = name.lower().replace(' ', '_') + '.' + ext.lower()
-            else:
-                normalized = part.lower().replace(' ', '_')
-            parts.append(normalized)
+            parts.append(normalize_path_part(part))
     
     # Reconstruct the path
     if path_obj.is_absolute():
@@ -52,6 +110,73 @@ def ensure_directory_exists(path):
     Path(path).mkdir(parents=True, exist_ok=True)
 
 
+def iter_dirs(root):
+    """Yield (dirpath, relpath, dirnames, filenames) for each directory under root.
+    
+    Directories are visited top-down and relpath is the path relative to root
+    ('' for root itself), tracked as the walk descends. Entry types come from
+    the cached os.scandir data. Like os.walk, symlinked directories are listed
+    in dirnames but not descended into, and unreadable directories are skipped.
+    """
+    stack = [(str(root), '')]
+    while stack:
+        dirpath, relpath = stack.pop()
+        dirnames = []
+        filenames = []
+        subdirs = []
+        try:
+            with os.scandir(dirpath) as entries:
+                for entry in entries:
+                    name = entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        dirnames.append(name)
+                        subdirs.append((entry.path, os.path.join(relpath, name) if relpath else name))
+                    elif entry.is_dir():
+                        # Symlink to a directory
+                        dirnames.append(name)
+                    else:
+                        filenames.append(name)
+        except OSError:
+            continue
+        yield dirpath, relpath, dirnames, filenames
+        # Reversed so subdirectories are visited in listing order
+        stack.extend(reversed(subdirs))
+
+
+def fast_copy(src, dst, preserve_times=True):
+    """Copy a file's contents and, optionally, its modification time.
+    
+    Uses os.copy_file_range where available so the kernel copies the data
+    without a userspace round trip (and can reflink on CoW filesystems),
+    falling back to shutil.copyfile. Unlike shutil.copy2, permission bits,
+    ACLs and extended attributes are not copied.
+    """
+    copied = False
+    if hasattr(os, 'copy_file_range'):
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                src_fd = fsrc.fileno()
+                dst_fd = fdst.fileno()
+                # Some filesystems (procfs, sysfs, certain FUSE and network
+                # mounts) report 0 bytes copied for a non-empty file; leave
+                # those to the regular copy
+                if os.copy_file_range(src_fd, dst_fd, 1 << 20):
+                    while os.copy_file_range(src_fd, dst_fd, 1 << 20):
+                        pass
+                    copied = True
+                else:
+                    copied = os.fstat(src_fd).st_size == 0
+        except OSError as e:
+            # Cross-device or unsupported filesystem, use the regular copy
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL):
+                raise
+    if not copied:
+        shutil.copyfile(src, dst)
+    if preserve_times:
+        st = os.stat(src)
+        os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
 def get_relative_path(from_path, to_path):
     """Get relative path from one file to another."""
     from_path = Path(from_path).resolve()
@@ -70,10 +195,9 @@ def get_relative_path(from_path, to_path):
 
 def extract_anchor(path):
     """Extract anchor from path if present."""
-    if '#' in str(path):
-        path_part, anchor = str(path).split('#', 1)
-        return path_part, '#' + anchor
-    return str(path), ''
+    # Split at the first '#', keeping it on the anchor
+    path_part, hash_sign, anchor = (path if isinstance(path, str) else str(path)).partition('#')
+    return path_part, hash_sign + anchor
 
 
 def clean_filename(filename):
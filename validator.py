@@ -1,9 +1,49 @@
 """Output validation for HTML to Markdown converter."""
 
+import mmap
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from utils import is_external_url, is_special_link
+from utils import is_external_url, is_special_link, iter_dirs
+
+
+# Markdown links and images on a single line, [text](url "title") and
+# ![alt](url "title"); group 1 is set for images. Link text cannot contain
+# '[', so the image in a linked image [![alt](src)](href) is found as an image.
+# Whitespace before the URL is skipped, as in [text]( url).
+# Matched against the raw UTF-8 bytes, since the syntax is all ASCII
+_REF_RE = re.compile(
+    rb'(?:(!)\[[^\]\n]*|\[[^\[\]\n]+)\]\([^\S\n]*([^)\s]+)(?:[^\S\n][^)\n]*)?\)'
+)
+
+# Files at least this large are memory-mapped instead of read into memory
+_MMAP_MIN_SIZE = 64 * 1024
+
+# Characters that can make a name fail the naming checks: ASCII uppercase,
+# spaces, and any non-ASCII character (which may have a lowercase form)
+_NAME_FLAG_RE = re.compile(r'[A-Z ]|[^\x00-\x7f]')
+
+# Report messages by kind. Errors and warnings are stored as (kind, *args)
+# tuples and only formatted when they are printed
+_MESSAGES = {
+    'dir_case': "Directory not lowercase: {}/{}",
+    'dir_space': "Directory contains spaces: {}/{}",
+    'file_case': "File not lowercase: {}/{}",
+    'file_space': "File contains spaces: {}/{}",
+    'static_case': "Static file not lowercase: {}/{}",
+    'static_space': "Static file contains spaces: {}/{}",
+    'unreadable': "Cannot read file {}: {}",
+    'image_path': "Relative image path in {}:{} - {}",
+    'link_path': "Relative path found in {}:{} - {}",
+    'broken_link': "Broken link in {}:{} - {} (resolved to {})",
+    'missing_image': "Missing image in {}:{} - {} (resolved to {})",
+}
+
+
+def _format_message(message):
+    """Format an error or warning stored as a (kind, *args) tuple."""
+    return _MESSAGES[message[0]].format(*message[1:])
 
 
 class OutputValidator:
@@ -14,6 +54,15 @@ class OutputValidator:
         self.static_dir = Path(static_dir)
         self.errors = []
         self.warnings = []
+        
+        # Paths found by the naming walk, relative to the output directory's
+        # parent and '/'-separated, so most targets need no stat call
+        self._valid_targets = set()
+        
+        # Whether each other link or image target exists; they are resolved
+        # against the output directory's parent
+        self._exists_cache = {}
+        self._target_base = os.fspath(self.output_dir.parent)
     
     def validate(self):
         """Run all validation checks."""
@@ -22,10 +71,13 @@ class OutputValidator:
         # Clear previous results
         self.errors = []
         self.warnings = []
+        self._valid_targets = set()
+        self._exists_cache = {}
         
-        # Run validation checks
-        self._validate_naming_conventions()
-        self._validate_markdown_files()
+        # Run validation checks; the naming check collects the markdown files
+        # so the output directory is only walked once
+        md_files = self._validate_naming_conventions()
+        self._validate_markdown_files(md_files)
         
         # Report results
         self._report_results()
@@ -33,111 +85,152 @@ class OutputValidator:
         return len(self.errors) == 0
     
     def _validate_naming_conventions(self):
-        """Validate that all files and directories follow naming conventions."""
-        # Check output directory
-        for root, dirs, files in os.walk(self.output_dir):
-            # Check directory names
-            for dir_name in dirs:
-                if dir_name != dir_name.lower():
-                    self.errors.append(f"Directory not lowercase: {root}/{dir_name}")
-                if ' ' in dir_name:
-                    self.errors.append(f"Directory contains spaces: {root}/{dir_name}")
-            
-            # Check file names
-            for file_name in files:
-                if file_name != file_name.lower():
-                    self.errors.append(f"File not lowercase: {root}/{file_name}")
-                if ' ' in file_name:
-                    self.errors.append(f"File contains spaces: {root}/{file_name}")
-        
-        # Check static directory if it exists
+        """Validate that all files and directories follow naming conventions.
+        
+        Returns the markdown files found in the output directory, in walk order.
+        """
+        md_files = []
+        
+        # Each walk: (directory, where its problems go, message kinds for
+        # directory names or None to skip them, message kinds for file names,
+        # whether to collect its markdown files)
+        walks = [(self.output_dir, self.errors.append, ('dir_case', 'dir_space'),
+                  ('file_case', 'file_space'), True)]
+        # Names in the static directory only produce warnings
         if self.static_dir.exists():
-            for root, dirs, files in os.walk(self.static_dir):
+            walks.append((self.static_dir, self.warnings.append, None,
+                          ('static_case', 'static_space'), False))
+        
+        # Bound once for the per-entry loops
+        add_md_file = md_files.append
+        flagged = _NAME_FLAG_RE.search
+        
+        for top, add, dir_kinds, file_kinds, collect_md in walks:
+            prefix = self._target_prefix(top)
+            for root, rel_path, dirs, files in iter_dirs(top):
+                if prefix is not None:
+                    self._record_targets(prefix, rel_path, dirs, files)
+                
+                # Check directory names
+                if dir_kinds:
+                    for dir_name in dirs:
+                        # Names without a flagged character pass both checks
+                        if not flagged(dir_name):
+                            continue
+                        if dir_name != dir_name.lower():
+                            add((dir_kinds[0], root, dir_name))
+                        if ' ' in dir_name:
+                            add((dir_kinds[1], root, dir_name))
+                
+                # Check file names
                 for file_name in files:
+                    if collect_md and file_name.endswith('.md'):
+                        add_md_file(os.path.join(root, file_name))
+                    if not flagged(file_name):
+                        continue
                     if file_name != file_name.lower():
-                        self.warnings.append(f"Static file not lowercase: {root}/{file_name}")
+                        add((file_kinds[0], root, file_name))
                     if ' ' in file_name:
-                        self.warnings.append(f"Static file contains spaces: {root}/{file_name}")
+                        add((file_kinds[1], root, file_name))
+        
+        return md_files
     
-    def _validate_markdown_files(self):
-        """Validate content of markdown files."""
-        # Find all markdown files
-        md_files = list(self.output_dir.rglob('*.md'))
+    def _target_prefix(self, root):
+        """Get the target path prefix of a walked directory, if it has one.
         
-        for md_file in md_files:
-            self._validate_markdown_file(md_file)
+        Link targets are resolved against the output directory's parent; a
+        directory outside it gets None and its paths are not recorded.
+        """
+        parent = self.output_dir.parent
+        try:
+            rel_root = root.relative_to(parent)
+        except ValueError:
+            return None
+        if not rel_root.parts:
+            return None
+        return rel_root.as_posix() + '/'
+    
+    def _record_targets(self, prefix, rel_path, dirs, files):
+        """Record a walked directory and its entries as existing targets."""
+        base = prefix + rel_path.replace(os.sep, '/') + '/' if rel_path else prefix
+        valid_targets = self._valid_targets
+        valid_targets.add(base[:-1])
+        valid_targets.update(base + name for name in dirs)
+        valid_targets.update(base + name for name in files)
+    
+    def _validate_markdown_files(self, md_files):
+        """Validate content of markdown files."""
+        # Files are checked independently, so their reads can overlap; each
+        # returns its own errors, which are added in file order
+        workers = min(32, (os.cpu_count() or 1) * 4)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for file_errors in executor.map(self._validate_markdown_file, md_files):
+                self.errors.extend(file_errors)
     
     def _validate_markdown_file(self, file_path):
-        """Validate a single markdown file."""
+        """Validate a single markdown file and return its errors."""
+        errors = []
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
+            with open(file_path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size >= _MMAP_MIN_SIZE:
+                    content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                else:
+                    content = f.read()
         except (IOError, OSError) as e:
-            self.errors.append(f"Cannot read file {file_path}: {e}")
-            return
+            errors.append(('unreadable', file_path, e))
+            return errors
         
-        # Extract all links and images
-        links = self._extract_links(content)
-        images = self._extract_images(content)
-        
-        # Validate links
-        for link, line_num in links:
-            if is_external_url(link) or is_special_link(link):
-                continue
-            
-            if not link.startswith('./'):
-                self.errors.append(
-                    f"Relative path found in {file_path}:{line_num} - {link}"
-                )
-            else:
-                # Check if referenced file exists
-                self._check_link_target(link, file_path, line_num)
-        
-        # Validate images
-        for image, line_num in images:
-            if is_external_url(image):
-                continue
-            
-            if not image.startswith('./'):
-                self.errors.append(
-                    f"Relative image path in {file_path}:{line_num} - {image}"
-                )
-            else:
-                # Check if image exists
-                self._check_image_target(image, file_path, line_num)
-    
-    def _extract_links(self, content):
-        """Extract all markdown links from content."""
-        links = []
-        lines = content.split('\n')
-        
-        # Match [text](url) pattern
-        pattern = r'\[([^\]]+)\]\(([^)]+)\)'
-        
-        for i, line in enumerate(lines, 1):
-            for match in re.finditer(pattern, line):
-                url = match.group(2).split()[0]  # Handle titles in links
-                links.append((url, i))
+        try:
+            # Every link and image contains '](', so files without it need no
+            # scan; for a mapped file only the pages up to a match are read
+            if content.find(b'](') >= 0:
+                self._check_refs(content, file_path, errors)
+        finally:
+            if isinstance(content, mmap.mmap):
+                content.close()
         
-        return links
+        return errors
     
-    def _extract_images(self, content):
-        """Extract all markdown images from content."""
-        images = []
-        lines = content.split('\n')
-        
-        # Match ![text](url) pattern
-        pattern = r'!\[([^\]]*)\]\(([^)]+)\)'
-        
-        for i, line in enumerate(lines, 1):
-            for match in re.finditer(pattern, line):
-                url = match.group(2).split()[0]  # Handle titles in images
-                images.append((url, i))
+    def _check_refs(self, content, file_path, errors):
+        """Check the links and images in a file's content, adding to errors."""
+        for is_image, url, line_num in self._extract_refs(content):
+            if is_image:
+                if is_external_url(url):
+                    continue
+                
+                if not url.startswith('./'):
+                    errors.append(('image_path', file_path, line_num, url))
+                else:
+                    # Check if image exists
+                    self._check_image_target(url, file_path, line_num, errors)
+            else:
+                if is_external_url(url) or is_special_link(url):
+                    continue
+                
+                if not url.startswith('./'):
+                    errors.append(('link_path', file_path, line_num, url))
+                else:
+                    # Check if referenced file exists
+                    self._check_link_target(url, file_path, line_num, errors)
+    
+    def _extract_refs(self, content):
+        """Yield (is_image, url, line_num) for each link and image in content.
         
-        return images
+        The content (bytes or an mmap) is scanned once as a whole; line
+        numbers are counted forward from the previous match and only the URLs
+        are decoded.
+        """
+        line_num = 1
+        pos = 0
+        for match in _REF_RE.finditer(content):
+            start = match.start()
+            line_num += content[pos:start].count(b'\n')
+            pos = start
+            url = match.group(2).decode('utf-8', 'replace')
+            yield match.group(1) is not None, url, line_num
     
-    def _check_link_target(self, link, source_file, line_num):
-        """Check if a link target exists."""
+    def _check_link_target(self, link, source_file, line_num, errors):
+        """Check if a link target exists, adding an error to errors if not."""
         # Remove anchor if present
         if '#' in link:
             link = link.split('#')[0]
@@ -145,31 +238,30 @@ class OutputValidator:
         if not link:  # Just an anchor
             return
         
-        # Calculate target path
-        if link.startswith('./static/'):
-            # Static file
-            target = self.output_dir.parent / link[2:]
-        else:
-            # Relative to output dir
+        if not self._target_exists(link[2:]):
+            # Static files and documents both resolve from the output parent
             target = self.output_dir.parent / link[2:]
-        
-        if not target.exists():
-            self.errors.append(
-                f"Broken link in {source_file}:{line_num} - {link} (resolved to {target})"
-            )
+            errors.append(('broken_link', source_file, line_num, link, target))
     
-    def _check_image_target(self, image_path, source_file, line_num):
-        """Check if an image target exists."""
-        # Calculate target path
-        if image_path.startswith('./static/'):
-            target = self.output_dir.parent / image_path[2:]
-        else:
+    def _check_image_target(self, image_path, source_file, line_num, errors):
+        """Check if an image target exists, adding an error to errors if not."""
+        if not self._target_exists(image_path[2:]):
             target = self.output_dir.parent / image_path[2:]
+            errors.append(('missing_image', source_file, line_num, image_path, target))
+    
+    def _target_exists(self, rel_path):
+        """Check whether a path relative to the output directory's parent exists.
         
-        if not target.exists():
-            self.errors.append(
-                f"Missing image in {source_file}:{line_num} - {image_path} (resolved to {target})"
-            )
+        Paths seen by the naming walk are known to exist; anything else
+        (unnormalized paths, directories outside the walk) is stat'ed once.
+        """
+        if rel_path in self._valid_targets:
+            return True
+        exists = self._exists_cache.get(rel_path)
+        if exists is None:
+            exists = os.path.exists(os.path.join(self._target_base, rel_path))
+            self._exists_cache[rel_path] = exists
+        return exists
     
     def _report_results(self):
         """Report validation results."""
@@ -179,7 +271,7 @@ class OutputValidator:
         if self.errors:
             print(f"\n❌ Found {len(self.errors)} errors:")
             for error in self.errors[:10]:  # Show first 10 errors
-                print(f"  - {error}")
+                print(f"  - {_format_message(error)}")
             if len(self.errors) > 10:
                 print(f"  ... and {len(self.errors) - 10} more errors")
         else:
@@ -188,7 +280,7 @@ class OutputValidator:
         if self.warnings:
             print(f"\n⚠️  Found {len(self.warnings)} warnings:")
             for warning in self.warnings[:10]:  # Show first 10 warnings
-                print(f"  - {warning}")
+                print(f"  - {_format_message(warning)}")
             if len(self.warnings) > 10:
                 print(f"  ... and {len(self.warnings) - 10} more warnings")
         